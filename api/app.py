@@ -1,11 +1,27 @@
+import os
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
 from api.routes import memory, static, test, txt2img, ws
+from core import queue
+from core.types import SupportedModel
 
 app = FastAPI(docs_url="/api/docs", redoc_url="/api/redoc")
 
+
+@app.on_event("startup")
+def preload_model():
+    # Load and warm up the model once at process start instead of paying
+    # engine/pipeline deserialization on the first request
+    model = os.environ.get("PRELOAD_MODEL")
+    if model:
+        queue.model_handler.load_model(
+            SupportedModel(model),
+            backend=os.environ.get("PRELOAD_BACKEND", "PyTorch"),  # type: ignore
+        )
+
 # Origins that are allowed to access the API
 origins = [
     "http://localhost:5173",
@@ -1,12 +1,36 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from PIL.Image import Image
 
 from api.shared import state
 from core import queue
 from core.types import Txt2ImgQueueEntry
-from core.utils import convert_image_to_base64
+from core.utils import convert_image_to_base64, convert_image_to_stream
+
+try:
+    # Importing TRT pulls in the CUDA/TensorRT runtimes and registers
+    # plugins, pay that cost once at module load instead of per request
+    from core.inference.volta_accelerate import infer_trt  # noqa: F401
+
+    trt_available = True
+except ImportError:
+    trt_available = False
 
 router = APIRouter()
 
+# PNG encode is CPU bound and releases the GIL, so encoding a batch in
+# threads keeps the event loop free and scales with available cores
+encode_pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+
+def encode_images(images: List[Image]) -> List[str]:
+    return list(encode_pool.map(convert_image_to_base64, images))
+
 
 @router.post("/interupt")
 async def stop():
@@ -14,18 +38,42 @@ async def stop():
     return {"message": "Interupted"}
 
 
+def stream_images(images: List[Image]):
+    # Raw PNG parts instead of base64-in-JSON, saves the ~33% base64
+    # inflation and the JSON escape pass over multi-MB strings
+    for image in images:
+        yield b"--frame\r\nContent-Type: image/png\r\n\r\n"
+        yield convert_image_to_stream(image).read()
+        yield b"\r\n"
+    yield b"--frame--\r\n"
+
+
 @router.post("/generate")
-async def txt2img_job(job: Txt2ImgQueueEntry):
+async def txt2img_job(job: Txt2ImgQueueEntry, encoding: str = "base64"):
     # Create directory to save images if it does not exist
 
     if job.backend == "PyTorch":
         images, time = await queue.add_job(job)
     elif job.backend == "TensorRT":
+        if not trt_available:
+            raise HTTPException(status_code=400, detail="TensorRT is not available")
         images, time = await queue.add_job(job)
-        # infer_trt()
     else:
         raise HTTPException(status_code=400, detail="Invalid backend")
 
-    return {"message": "Job completed", 
-            "time": time, 
-            "images": [convert_image_to_base64(i) for i in images]}
+    # Streaming is opt-in: the bot and frontend expect the JSON payload,
+    # so base64 stays the default for clients that don't ask otherwise
+    if encoding == "stream":
+        return StreamingResponse(
+            stream_images(images),
+            media_type="multipart/x-mixed-replace; boundary=frame",
+            headers={"X-Duration": str(time)},
+        )
+
+    encoded = await asyncio.get_running_loop().run_in_executor(
+        None, encode_images, images
+    )
+
+    return {"message": "Job completed",
+            "time": time,
+            "images": encoded}
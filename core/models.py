@@ -1,54 +1,96 @@
 import gc
 import os
+import threading
 import time
-from typing import Dict, Union
+from typing import Dict, List, Literal, Union
 
 import torch
 
 from core.inference.pytorch import PyTorchInferenceModel
 from core.inference.volta_accelerate import DemoDiffusion
-from core.types import SupportedModel, Txt2ImgQueueEntry
+from core.types import Scheduler, SupportedModel, Txt2ImgQueueEntry
 
 
 class ModelHandler:
     def __init__(self) -> None:
         self.generated_models: Dict[SupportedModel, Union[DemoDiffusion, PyTorchInferenceModel]] = dict()
+        self.model_locks: Dict[SupportedModel, threading.RLock] = dict()
+
+    def _lock_for(self, model: SupportedModel) -> threading.RLock:
+        # A pipeline carries per-run state (scheduler ring buffers, binding
+        # shapes), so batches for the same model serialize here while
+        # batches for different models overlap in the queue's thread pool.
+        # setdefault is atomic, racing threads end up sharing one lock.
+        return self.model_locks.setdefault(model, threading.RLock())
+
+    def load_model(
+        self,
+        model: SupportedModel,
+        scheduler: Scheduler = Scheduler.default,
+        backend: Literal["PyTorch", "TensorRT"] = "PyTorch",
+        batch_size: int = 1,
+        height: int = 512,
+        width: int = 512,
+    ) -> None:
+        with self._lock_for(model):
+            self._load_model(model, scheduler, backend, batch_size, height, width)
+
+    def _load_model(
+        self,
+        model: SupportedModel,
+        scheduler: Scheduler,
+        backend: Literal["PyTorch", "TensorRT"],
+        batch_size: int,
+        height: int,
+        width: int,
+    ) -> None:
+        if model in self.generated_models:
+            return
+
+        if backend == "TensorRT":
+            print("Selecting TRT")
+            print("Creating...")
+            self.generated_models[model] = DemoDiffusion(
+                model_path=model.value,
+                denoising_steps=50,
+                denoising_fp16=True,
+                scheduler="LMSD",
+                hf_token=os.environ.get("HUGGINGFACE_TOKEN"),
+                verbose=False,
+                nvtx_profile=False,
+                max_batch_size=16
+            )
+            print("Loading engines...")
+            self.generated_models[model].loadEngines(
+                engine_dir='engine/'+model.value,
+                onnx_dir='onnx',
+                onnx_opset=16,
+                opt_batch_size=batch_size,
+                opt_image_height=height,
+                opt_image_width=width,
+            )
+            print("Loading modules")
+            self.generated_models[model].loadModules()
+            print("Loading done")
+        else:
+            print("Selecting PyTorch")
+            start_time = time.time()
+            self.generated_models[model] = PyTorchInferenceModel(model.value, scheduler)
+            self.generated_models[model].optimize()
+            print(f"Finished loading in {time.time() - start_time:.2f}s")
 
     def generate(self, job: Txt2ImgQueueEntry):
         if job.model not in self.generated_models:
             print("Model not loaded")
-            if job.backend == "TensorRT":
-                print("Selecting TRT")
-                print("Creating...")
-                self.generated_models[job.model] = DemoDiffusion(
-                    model_path=job.model.value,
-                    denoising_steps=50,
-                    denoising_fp16=True,
-                    scheduler="LMSD",
-                    hf_token=os.environ.get("HUGGINGFACE_TOKEN"),
-                    verbose=False,
-                    nvtx_profile=False,
-                    max_batch_size=16
-                )
-                print("Loading engines...")
-                self.generated_models[job.model].loadEngines(
-                    engine_dir='engine/'+job.model.value,
-                    onnx_dir='onnx',
-                    onnx_opset=16,
-                    opt_batch_size=len(job.data.prompt),
-                    opt_image_height=job.data.height,
-                    opt_image_width=job.data.width,
-                )
-                print("Loading modules")
-                self.generated_models[job.model].loadModules()
-                print("Loading done")
-            else:
-                print("Selecting PyTorch")
-                start_time = time.time()
-                self.generated_models[job.model] = PyTorchInferenceModel(job.model.value, job.scheduler)
-                self.generated_models[job.model].optimize()
-                print(f"Finished loading in {time.time() - start_time:.2f}s")
-        
+            self.load_model(
+                job.model,
+                job.scheduler,
+                job.backend,
+                batch_size=len(job.data.prompt),
+                height=job.data.height,
+                width=job.data.width,
+            )
+
         print("Model loaded")
         if isinstance(self.generated_models[job.model], DemoDiffusion):
             pipeline_time, images = self.generated_models[job.model].infer(
@@ -66,6 +108,32 @@ class ModelHandler:
         else:
             return self.generated_models[job.model].generate(job.data)
 
+    def generate_batch(self, jobs: List[Txt2ImgQueueEntry]):
+        first = jobs[0]
+        # RLock: load_model below re-enters the same model's lock
+        with self._lock_for(first.model):
+            return self._generate_batch(jobs)
+
+    def _generate_batch(self, jobs: List[Txt2ImgQueueEntry]):
+        first = jobs[0]
+        self.load_model(
+            first.model,
+            first.scheduler,
+            first.backend,
+            batch_size=len(first.data.prompt),
+            height=first.data.height,
+            width=first.data.width,
+        )
+
+        model = self.generated_models[first.model]
+        if isinstance(model, DemoDiffusion) or len(jobs) == 1:
+            # The TRT path has no batched entrypoint, run jobs one by one
+            return [self.generate(job) for job in jobs]
+
+        # One UNet forward pass for all compatible prompts
+        images = model.generate_batch([job.data for job in jobs])
+        return [[image] for image in images]
+
     def unload(self, model: SupportedModel):
         if model in self.generated_models:
             self.generated_models[model].unload()
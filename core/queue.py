@@ -1,9 +1,9 @@
 import asyncio
 import logging
 import time
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
-from threading import Thread
-from typing import List, Tuple
+from typing import Deque, List, Optional, Set, Tuple
 
 from PIL.Image import Image
 
@@ -12,81 +12,111 @@ from core.models import ModelHandler
 from core.types import Txt2ImgQueueEntry
 
 
-class ThreadWithReturnValue(Thread):
-    
-    def __init__(self, group=None, target=None, name=None,
-                 args=(), kwargs={}):
-        super().__init__(group, target, name, args, kwargs)
-        self._return = None
+def run(model_handler: ModelHandler, jobs: List[Txt2ImgQueueEntry]) -> List[List[Image]]:
+        return model_handler.generate_batch(jobs)
 
-    def run(self):
-        if self._target is not None: # type: ignore
-            self._return = self._target(*self._args,**self._kwargs) # type: ignore
-                                                
-    def join(self, *args):
-        Thread.join(self, *args)
-        return self._return
 
-def run(model_handler: ModelHandler, job: Txt2ImgQueueEntry) -> List[Image]:
-        return model_handler.generate(job)
-    
+def compatible(a: Txt2ImgQueueEntry, b: Txt2ImgQueueEntry) -> bool:
+    "Check whether two jobs can share a single batched forward pass"
+    return (
+        a.model == b.model
+        and a.backend == b.backend
+        and a.scheduler == b.scheduler
+        and a.data.width == b.data.width
+        and a.data.height == b.data.height
+        and a.data.steps == b.data.steps
+        and a.data.guidance_scale == b.data.guidance_scale
+    )
+
 
 class Queue:
     def __init__(self) -> None:
-        self.jobs: List[Txt2ImgQueueEntry] = list()
-        self.running = False
+        self.jobs: Deque[Tuple[Txt2ImgQueueEntry, asyncio.Future]] = deque()
         self.model_handler: ModelHandler = ModelHandler()
-        self.thread_pool = ThreadPoolExecutor(max_workers=1)
-    
+        # Several workers let batches for different models (or backends)
+        # overlap on the GPU; batches for the same model serialize on the
+        # handler's per-model lock, and the TRT engines hand each worker
+        # thread its own execution context
+        self.thread_pool = ThreadPoolExecutor(max_workers=4)
+        # How long to wait for more compatible jobs before running a batch
+        self.batch_window = 0.02
+        self.max_batch_size = 4
+        self.worker: Optional[asyncio.Task] = None
+        # Keep in-flight batch tasks referenced so they are not collected
+        self.batch_tasks: Set[asyncio.Task] = set()
+
     async def add_job(self, job: Txt2ImgQueueEntry) -> Tuple[List[Image], float]:
+        logging.info(f"Adding job {job.data.id} to queue")
+
+        if job.data.width % 8 != 0 or job.data.height % 8 != 0:
+            raise DimensionError("Width and height must be divisible by 8")
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.jobs.append((job, future))
+
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self.process_jobs())
+
+        start_time = time.time()
+
+        # No cleanup needed on failure: a failed entry was already popped
+        # when its batch ran, and a cancelled one is skipped by the worker
+        images = await future
+
+        deltatime = time.time() - start_time
+
+        return (images, deltatime)
+
+    async def process_jobs(self) -> None:
+        while self.jobs:
+            # Give concurrent requests a short window to pile up so
+            # compatible jobs can share one UNet forward pass
+            await asyncio.sleep(self.batch_window)
+
+            # One pass over the deque: compatible entries join the batch,
+            # everything else rotates back in its original order. This is
+            # O(n) per batch where the list scan plus remove() was O(n^2)
+            batch = [self.jobs.popleft()]
+            head = batch[0][0]
+            for _ in range(len(self.jobs)):
+                entry = self.jobs.popleft()
+                if len(batch) < self.max_batch_size and compatible(head, entry[0]):
+                    batch.append(entry)
+                else:
+                    self.jobs.append(entry)
+
+            # Dispatch without awaiting so the next batch can start while
+            # this one is still on the GPU; overlap is bounded by the pool
+            task = asyncio.create_task(self.run_batch(batch))
+            self.batch_tasks.add(task)
+            task.add_done_callback(self.batch_tasks.discard)
+
+    async def run_batch(
+        self, batch: List[Tuple[Txt2ImgQueueEntry, asyncio.Future]]
+    ) -> None:
+        logging.info(f"Running batch of {len(batch)} jobs")
+
+        # Run generation in the executor; the await wakes up the moment
+        # the batch finishes instead of polling on a 100 ms quantum
         try:
-            logging.info(f"Adding job {job.data.id} to queue")
-            
-            if job.data.width % 8 != 0 or job.data.height % 8 != 0:
-                raise DimensionError("Width and height must be divisible by 8")
-            
-            self.jobs.append(job)
-            
-            # Wait for the job to be at the front of the queue
-            while self.jobs[0] != job:
-                await asyncio.sleep(0.1)
-            
-
-            start_time = time.time()
-            
-            # create a new thread
-            thread = ThreadWithReturnValue(target=run, args=(self.model_handler, job))
-
-            # start the thread
-            thread.start()
-
-            # wait for the thread to finish
-            logging.info(f"Job {job} finished")
-            
-            # get the value returned from the thread
-            while thread.is_alive():
-                await asyncio.sleep(0.1)
-            
-            images = thread.join()
-            
-            self.jobs.pop(0)
-            
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.thread_pool,
+                run,
+                self.model_handler,
+                [entry[0] for entry in batch],
+            )
+        except Exception:
+            logging.exception("Batch failed")
+            results = None
+
+        for (job, future), images in zip(
+            batch, results if results else [None] * len(batch)
+        ):
+            if future.cancelled():
+                continue
             if images is None:
-                raise ModelFailedError("Model failed to generate image")
-        
-            deltatime = time.time() - start_time
-
-            return (images, deltatime)
-
-        except Exception as e:
-            # Clean up the queue
-            if job in self.jobs:
-                self.jobs.remove(job)
-            
-            raise e
-
-
-
-
-
-
+                future.set_exception(
+                    ModelFailedError("Model failed to generate image")
+                )
+            else:
+                future.set_result(images)
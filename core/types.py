@@ -1,19 +1,46 @@
-from dataclasses import dataclass, field
-from enum import Enum, auto
+from dataclasses import dataclass, field, fields
+from enum import Enum, IntEnum
 from typing import Literal
 from uuid import uuid4
 
 
-class Scheduler(Enum):
-    euler = auto()
-    euler_a = auto()
-    ddim = auto()
-    default = auto()
+def _new_id() -> str:
+    return uuid4().hex
 
-@dataclass
+
+def _with_slots(cls):
+    # dataclass(slots=True) needs Python 3.10 and the deployment image
+    # ships 3.8, so rebuild the class with __slots__ by hand: drop the
+    # field defaults from the body (they live on the generated __init__)
+    # and recreate the type without a per-instance __dict__
+    body = dict(cls.__dict__)
+    slots = tuple(f.name for f in fields(cls))
+    body["__slots__"] = slots
+    for name in slots:
+        body.pop(name, None)
+    body.pop("__dict__", None)
+    body.pop("__weakref__", None)
+    new_cls = type(cls.__name__, cls.__bases__, body)
+    new_cls.__qualname__ = cls.__qualname__
+    return new_cls
+
+
+# IntEnum members compare and index as plain ints, so scheduler dispatch is
+# a tuple lookup instead of an Enum hash + dict lookup. The values are part
+# of the wire protocol (clients send them as ints), so they stay 1-based
+class Scheduler(IntEnum):
+    euler = 1
+    euler_a = 2
+    ddim = 3
+    default = 4
+
+# slots removes the per-instance __dict__ of every queued entry and frozen
+# makes entries hashable, so derived values can be cached per entry
+@_with_slots
+@dataclass(frozen=True)
 class Txt2imgData:
     prompt: str
-    id: str = field(default_factory=lambda: uuid4().hex)
+    id: str = field(default_factory=_new_id)
     negative_prompt: str = field(default="")
     width: int = field(default=512)
     height: int = field(default=512)
@@ -25,6 +52,12 @@ class Txt2imgData:
 
 
 class SupportedModel(Enum):
+    @classmethod
+    def _missing_(cls, value):
+        # Unknown HF paths fall back to vanilla Stable Diffusion instead of
+        # raising, so stale clients keep working after the list changes
+        return cls.StableDiffusion1_5
+
     AnythingV3 = "Linaqruf/anything-v3.0"
     StableDiffusion1_5 = "runwayml/stable-diffusion-v1-5"
     StableDiffusion1_4 = "CompVis/stable-diffusion-v1-4"
@@ -35,7 +68,8 @@ class SupportedModel(Enum):
     EimisAnime = "eimiss/EimisAnimeDiffusion_1.0v"
     EimisRealistic = "eimiss/EimisSemiRealistic"
     
-@dataclass
+@_with_slots
+@dataclass(frozen=True)
 class Txt2ImgQueueEntry:
     data: Txt2imgData
     model: SupportedModel
@@ -1,8 +1,15 @@
 import base64
 from io import BytesIO
 
+import numpy as np
 from PIL.Image import Image
 
+try:
+    # SIMD accelerated PNG encoder, ~10x faster than PIL's filter loop
+    import pyspng
+except ImportError:
+    pyspng = None
+
 
 def convert_image_to_stream(image: Image) -> BytesIO:
     stream = BytesIO()
@@ -11,8 +18,11 @@ def convert_image_to_stream(image: Image) -> BytesIO:
     return stream
 
 def convert_image_to_base64(image: Image) -> str:
-    stream = convert_image_to_stream(image)
-    return base64.b64encode(stream.read()).decode("utf-8")
+    if pyspng is not None and hasattr(pyspng, "encode"):
+        data = pyspng.encode(np.asarray(image), compress_level=1)
+    else:
+        data = convert_image_to_stream(image).read()
+    return base64.b64encode(data).decode("utf-8")
 
 def convert_base64_to_bytes(data: str):
-    return BytesIO(base64.b64decode(data))
\ No newline at end of file
+    return BytesIO(base64.b64decode(data))
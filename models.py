@@ -927,11 +927,48 @@ class BaseModel:
     def get_sample_input(self, batch_size, image_height, image_width):
         pass
 
+    # (batch, height, width) buckets that each get their own optimization
+    # profile, so common shape changes don't force an engine rebuild
+    profile_buckets = [
+        (1, 512, 512),
+        (2, 512, 512),
+        (4, 512, 512),
+        (8, 512, 512),
+        (1, 768, 768),
+        (4, 768, 768),
+    ]
+
     def get_input_profile(
         self, batch_size, image_height, image_width, static_batch, static_shape
     ):
         return None
 
+    def get_input_profiles(
+        self, batch_size, image_height, image_width, static_batch, static_shape
+    ):
+        """
+        One optimization profile per supported shape bucket, the requested
+        shape first so it stays profile 0.
+        """
+        profiles = [
+            self.get_input_profile(
+                batch_size, image_height, image_width, static_batch, static_shape
+            )
+        ]
+        for batch, height, width in self.profile_buckets:
+            if (batch, height, width) == (batch_size, image_height, image_width):
+                continue
+            try:
+                profiles.append(
+                    self.get_input_profile(
+                        batch, height, width, static_batch, static_shape
+                    )
+                )
+            except AssertionError:
+                # Bucket outside this model's supported dimension range
+                continue
+        return profiles
+
     def get_shape_dict(self, batch_size, image_height, image_width):
         return None
 
@@ -996,19 +1033,20 @@ class CLIP(BaseModel):
         min_batch, max_batch, _, _, _, _ = self.get_minmax_dims(
             batch_size, image_height, image_width, static_batch, static_shape
         )
+        # Negative and positive prompts run as one stacked batch
         return {
             "input_ids": [
-                (min_batch, self.text_maxlen),
-                (batch_size, self.text_maxlen),
-                (max_batch, self.text_maxlen),
+                (2 * min_batch, self.text_maxlen),
+                (2 * batch_size, self.text_maxlen),
+                (2 * max_batch, self.text_maxlen),
             ]
         }
 
     def get_shape_dict(self, batch_size, image_height, image_width):
         self.check_dims(batch_size, image_height, image_width)
         return {
-            "input_ids": (batch_size, self.text_maxlen),
-            "text_embeddings": (batch_size, self.text_maxlen, self.embedding_dim),
+            "input_ids": (2 * batch_size, self.text_maxlen),
+            "text_embeddings": (2 * batch_size, self.text_maxlen, self.embedding_dim),
         }
 
     def get_sample_input(self, batch_size, image_height, image_width):
@@ -1102,6 +1140,9 @@ class UNet(BaseModel):
         ) = self.get_minmax_dims(
             batch_size, image_height, image_width, static_batch, static_shape
         )
+        # The 2x batch dimension is classifier-free guidance: uncond and
+        # cond halves run as one stacked UNet pass per denoising step and
+        # are split and combined on-device afterwards
         return {
             "sample": [
                 (2 * min_batch, 4, min_latent_height, min_latent_width),
@@ -18,13 +18,17 @@
 
 from collections import OrderedDict
 from copy import copy
+import hashlib
+import inspect
 import numpy as np
 import os
 import math
+import threading
+from types import SimpleNamespace
 from PIL import Image
 from polygraphy.backend.common import bytes_from_path
 from polygraphy.backend.trt import CreateConfig, Profile
-from polygraphy.backend.trt import engine_from_bytes, engine_from_network, network_from_onnx_path, save_engine
+from polygraphy.backend.trt import engine_from_bytes, engine_from_network, network_from_onnx_bytes, network_from_onnx_path, save_engine
 from polygraphy.backend.trt import util as trt_util
 from polygraphy import cuda
 import random
@@ -34,32 +38,143 @@ import torch
 
 TRT_LOGGER = trt.Logger(trt.Logger.WARNING)
 
+
+def _lms_update(latents, derivatives, coeffs):
+    # Coefficient-weighted sum over the derivative ring buffer plus the
+    # latent update, fused into a single kernel by torch.compile below
+    # instead of one launch per multistep term
+    return latents + torch.tensordot(coeffs, derivatives, dims=1)
+
+
+if hasattr(torch, "compile"):
+    _lms_update = torch.compile(_lms_update, mode="reduce-overhead")
+
+
+class SDInt8Calibrator(trt.IInt8EntropyCalibrator2):
+    """
+    Entropy calibrator for INT8 engine builds. Feeds pre-captured input
+    batches (dicts of binding name -> numpy array, typically recorded from a
+    short FP16 run over representative prompts) to the builder, and persists
+    the resulting calibration table so later builds skip calibration.
+    """
+
+    def __init__(self, batches, cache_path):
+        super().__init__()
+        self.batches = iter(batches)
+        self.cache_path = cache_path
+        self.device_buffers = {}
+
+    def get_batch_size(self):
+        return 1
+
+    def get_batch(self, names):
+        try:
+            batch = next(self.batches)
+        except StopIteration:
+            self.free()
+            return None
+        ptrs = []
+        for name in names:
+            array = np.ascontiguousarray(batch[name])
+            buf = self.device_buffers.get(name)
+            if buf is None or buf.shape != array.shape:
+                buf = cuda.DeviceArray(shape=array.shape, dtype=array.dtype)
+                self.device_buffers[name] = buf
+            buf.copy_from(array)
+            ptrs.append(buf.ptr)
+        return ptrs
+
+    def read_calibration_cache(self):
+        if os.path.exists(self.cache_path):
+            with open(self.cache_path, "rb") as f:
+                return f.read()
+        return None
+
+    def write_calibration_cache(self, cache):
+        with open(self.cache_path, "wb") as f:
+            f.write(cache)
+
+    def free(self):
+        for buf in self.device_buffers.values():
+            buf.free()
+        self.device_buffers = {}
+
+
+def supported_precisions():
+    """
+    Reduced-precision build flags the installed polygraphy/TRT accept.
+    Older releases (e.g. the TRT 8.5 container) predate the bf16/fp8
+    CreateConfig arguments, and passing them raises TypeError at build.
+    """
+    params = inspect.signature(CreateConfig.__init__).parameters
+    return {flag for flag in ("fp16", "bf16", "fp8", "int8") if flag in params}
+
+
 class Engine():
     def __init__(
         self,
         model_name,
         engine_dir,
     ):
+        self.model_name = model_name
+        self.engine_dir = engine_dir
         self.engine_path = os.path.join(engine_dir, model_name+'.plan')
         self.engine = None
-        self.context = None
-        self.buffers = OrderedDict()
-        self.tensors = OrderedDict()
+        # Execution state lives per thread: the deserialized engine is
+        # shareable, but an IExecutionContext and the buffers bound to it
+        # must only ever be touched by one thread at a time, so every
+        # worker thread lazily gets its own context and buffer pools
+        self._tls = threading.local()
+
+    def set_cache_key(self, input_profile=None, precision=None):
+        """
+        Content-address the serialized plan. Plans are only valid for the
+        exact GPU arch, TRT version, shape profiles and precision they were
+        built with, so all of that goes into the file name and an unrelated
+        argument change no longer forces a minutes-long rebuild.
+        """
+        sm = "cpu"
+        if torch.cuda.is_available():
+            sm = "sm{}{}".format(*torch.cuda.get_device_capability(0))
+        key = hashlib.sha1(
+            f"{self.engine_dir}|{self.model_name}|{sm}|{trt.__version__}|{input_profile}|{precision}".encode()
+        ).hexdigest()
+        self.engine_path = os.path.join(
+            self.engine_dir, f"{self.model_name}.{key[:12]}.plan"
+        )
+
+    @staticmethod
+    def timing_cache_path():
+        """
+        One timing cache shared by every model. Tactic timings depend on the
+        GPU architecture and TRT version rather than the network, so builds
+        of clip/unet/vae hit each other's measurements; the file is keyed by
+        compute capability so a different GPU never reads stale timings.
+        """
+        sm = "cpu"
+        if torch.cuda.is_available():
+            sm = "sm{}{}".format(*torch.cuda.get_device_capability(0))
+        return os.path.join("engine", f"timing_{sm}.cache")
 
     def __del__(self):
-        [buf.free() for buf in self.buffers.values() if isinstance(buf, cuda.DeviceArray) ]
+        state = getattr(self._tls, "state", None)
+        if state is not None:
+            [buf.free() for buf in state.buffers.values() if isinstance(buf, cuda.DeviceArray) ]
         del self.engine
-        del self.context
-        del self.buffers
-        del self.tensors
+        del self._tls
 
-    def build(self, onnx_path, fp16, input_profile=None, enable_preview=False):
+    def build(self, onnx_path, fp16, input_profile=None, enable_preview=False, precision=None, calibrator=None):
         print(f"Building TensorRT engine for {onnx_path}: {self.engine_path}")
-        p = Profile()
-        if input_profile:
-            for name, dims in input_profile.items():
+        # One Profile per shape bucket, a single engine serves them all
+        if isinstance(input_profile, dict):
+            input_profile = [input_profile]
+        profiles = []
+        for profile in input_profile or [{}]:
+            p = Profile()
+            for name, dims in profile.items():
                 assert len(dims) == 3
                 p.add(name, min=dims[0], opt=dims[1], max=dims[2])
+            profiles.append(p)
 
         preview_features = []
         if enable_preview:
@@ -69,45 +184,142 @@ class Engine():
                 (trt_version[0] == 8 and (trt_version[1] > 5 or (trt_version[1] == 5 and trt_version[2] >= 1))):
                 preview_features = [trt.PreviewFeature.FASTER_DYNAMIC_SHAPES_0805]
 
-        engine = engine_from_network(network_from_onnx_path(onnx_path), config=CreateConfig(fp16=fp16,max_workspace_size=8100654080, profiles=[p],
-            preview_features=preview_features))
-        save_engine(engine, path=self.engine_path)
+        # Precision overrides the plain fp16 flag when the builder supports it
+        precision_flags = {"fp16": fp16}
+        if precision == "bf16":
+            precision_flags = {"bf16": True}
+        elif precision == "fp8":
+            precision_flags = {"fp8": True, "fp16": True}
+        elif precision == "int8":
+            # FP16 stays on so TRT can fall back per layer where INT8 would
+            # hurt accuracy; the calibrator supplies activation ranges
+            precision_flags = {"int8": True, "fp16": True, "calibrator": calibrator}
+
+        # A bytes payload skips re-parsing a model that is already in memory
+        if isinstance(onnx_path, (bytes, bytearray)):
+            network = network_from_onnx_bytes(bytes(onnx_path))
+        else:
+            network = network_from_onnx_path(onnx_path)
+        timing_cache = self.timing_cache_path()
+        os.makedirs(os.path.dirname(timing_cache), exist_ok=True)
+        engine = engine_from_network(network, config=CreateConfig(max_workspace_size=8100654080, profiles=profiles,
+            preview_features=preview_features, load_timing_cache=timing_cache, **precision_flags),
+            save_timing_cache=timing_cache)
+        # Write atomically so an interrupted build never leaves a truncated
+        # plan that would poison the cache
+        tmp_path = self.engine_path + ".tmp"
+        save_engine(engine, path=tmp_path)
+        os.replace(tmp_path, self.engine_path)
 
     def activate(self):
         print(f"Loading TensorRT engine: {self.engine_path}")
         self.engine = engine_from_bytes(bytes_from_path(self.engine_path))
-        self.context = self.engine.create_execution_context()
+
+    def _exec_state(self):
+        "Lazily create the calling thread's context and buffer pools"
+        state = getattr(self._tls, "state", None)
+        if state is None:
+            state = SimpleNamespace(
+                context=self.engine.create_execution_context(),
+                buffers=OrderedDict(),
+                tensors=OrderedDict(),
+                # Grow-only device allocations backing the bindings, by name
+                pools=OrderedDict(),
+                allocated_shapes=None,
+            )
+            self._tls.state = state
+        return state
+
+    def select_profile(self, shape_dict, stream):
+        "Activate the optimization profile that admits the requested shapes"
+        if self.engine.num_optimization_profiles <= 1:
+            return
+        context = self._exec_state().context
+        bindings_per_profile = trt_util.get_bindings_per_profile(self.engine)
+        for profile in range(self.engine.num_optimization_profiles):
+            fits = True
+            for offset in range(bindings_per_profile):
+                idx = profile * bindings_per_profile + offset
+                binding = self.engine[idx]
+                if not self.engine.binding_is_input(binding):
+                    continue
+                name = binding.split(" [profile")[0]
+                if not shape_dict or name not in shape_dict:
+                    continue
+                min_shape, _, max_shape = self.engine.get_profile_shape(profile, idx)
+                if any(s < mn or s > mx for s, mn, mx in zip(shape_dict[name], min_shape, max_shape)):
+                    fits = False
+                    break
+            if fits:
+                if context.active_optimization_profile != profile:
+                    context.set_optimization_profile_async(profile, stream.ptr)
+                return
+        raise ValueError(f"No optimization profile admits shapes {shape_dict}")
 
     def allocate_buffers(self, shape_dict=None, device='cuda'):
-        for idx in range(trt_util.get_bindings_per_profile(self.engine)):
+        state = self._exec_state()
+        # Serving repeats the same shapes call after call; reallocating per
+        # infer churns VRAM and invalidates the pointers CUDA Graph capture
+        # depends on, so this is a no-op when nothing changed
+        key = (
+            tuple(sorted((name, tuple(shape)) for name, shape in shape_dict.items()))
+            if shape_dict
+            else None,
+            device,
+            state.context.active_optimization_profile,
+        )
+        if state.allocated_shapes == key:
+            return
+        state.allocated_shapes = key
+
+        start_binding, end_binding = trt_util.get_active_profile_bindings(state.context)
+        for idx in range(start_binding, end_binding):
             binding = self.engine[idx]
-            if shape_dict and binding in shape_dict:
-                shape = shape_dict[binding]
+            # Bindings of profile N are suffixed with ' [profile N]'
+            name = binding.split(" [profile")[0]
+            if shape_dict and name in shape_dict:
+                shape = shape_dict[name]
             else:
                 shape = self.engine.get_binding_shape(binding)
             dtype = trt_util.np_dtype_from_trt(self.engine.get_binding_dtype(binding))
             if self.engine.binding_is_input(binding):
-                self.context.set_binding_shape(idx, shape)
+                state.context.set_binding_shape(idx, shape)
             # Workaround to convert np dtype to torch
             np_type_tensor = np.empty(shape=[], dtype=dtype)
             torch_type_tensor = torch.from_numpy(np_type_tensor)
-            tensor = torch.empty(tuple(shape), dtype=torch_type_tensor.dtype).to(device=device)
-            self.tensors[binding] = tensor
-            self.buffers[binding] = cuda.DeviceView(ptr=tensor.data_ptr(), shape=shape, dtype=dtype)
+            # Each binding is backed by one grow-only pool allocation; a
+            # requested shape is served as a contiguous prefix view of it,
+            # so shrinking the batch never touches the allocator and the
+            # binding pointer stays stable for CUDA Graph capture
+            numel = int(np.prod(shape))
+            pool = state.pools.get(name)
+            if (
+                pool is None
+                or pool.dtype != torch_type_tensor.dtype
+                or pool.numel() < numel
+            ):
+                pool = torch.empty(
+                    numel, dtype=torch_type_tensor.dtype, device=device
+                )
+                state.pools[name] = pool
+            tensor = pool[:numel].view(tuple(shape))
+            state.tensors[name] = tensor
+            state.buffers[name] = cuda.DeviceView(ptr=tensor.data_ptr(), shape=shape, dtype=dtype)
 
     def infer(self, feed_dict, stream):
-        start_binding, end_binding = trt_util.get_active_profile_bindings(self.context)
+        state = self._exec_state()
+        start_binding, end_binding = trt_util.get_active_profile_bindings(state.context)
         # shallow copy of ordered dict
-        device_buffers = copy(self.buffers)
+        device_buffers = copy(state.buffers)
         for name, buf in feed_dict.items():
             assert isinstance(buf, cuda.DeviceView)
             device_buffers[name] = buf
         bindings = [0] * start_binding + [buf.ptr for buf in device_buffers.values()]
-        noerror = self.context.execute_async_v2(bindings=bindings, stream_handle=stream.ptr)
+        noerror = state.context.execute_async_v2(bindings=bindings, stream_handle=stream.ptr)
         if not noerror:
             raise ValueError(f"ERROR: inference failed.")
 
-        return self.tensors
+        return state.tensors
 
 class LMSDiscreteScheduler():
     def __init__(
@@ -146,7 +358,9 @@ class LMSDiscreteScheduler():
 
         # Move all timesteps to correct device beforehand
         self.timesteps = torch.from_numpy(timesteps).to(device=self.device).float()
-        self.derivatives = []
+        # Ring buffer of the last `order` derivatives, allocated lazily on
+        # the first step once the latent shape is known
+        self.derivatives = None
 
     def scale_model_input(self, sample: torch.FloatTensor, idx, *args, **kwargs) -> torch.FloatTensor:
         return sample * self.latent_scales[idx]
@@ -174,22 +388,27 @@ class LMSDiscreteScheduler():
             order = min(step_index + 1, order)
             self.lms_coeffs.append([get_lms_coefficient(order, step_index, curr_order) for curr_order in range(order)])
 
+        # Per-step coefficient vectors aligned with the ring-buffer slots so
+        # the weighted sum in step() is a single tensordot over the buffer;
+        # unused slots stay zero and pair with the zero-initialized buffer
+        self.lms_coeff_slots = []
+        for step_index, coeffs in enumerate(self.lms_coeffs):
+            slots = torch.zeros(self.order, dtype=torch.float32, device=self.device)
+            for current_order, coeff in enumerate(coeffs):
+                slots[(step_index - current_order) % self.order] = coeff
+            self.lms_coeff_slots.append(slots)
+
     def step(self, output, latents, idx, timestep):
         # compute the previous noisy sample x_t -> x_t-1
-        # 1. compute predicted original sample (x_0) from sigma-scaled predicted noise
-        sigma = self.sigmas[idx]
-        pred_original_sample = latents - sigma * output
-        # 2. Convert to an ODE derivative
-        derivative = (latents - pred_original_sample) / sigma
-        self.derivatives.append(derivative)
-        if len(self.derivatives) > self.order:
-            self.derivatives.pop(0)
-        # 3. Compute previous sample based on the derivatives path
-        prev_sample = latents + sum(
-            coeff * derivative for coeff, derivative in zip(self.lms_coeffs[idx], reversed(self.derivatives))
-        )
-
-        return prev_sample
+        if self.derivatives is None or self.derivatives.shape[1:] != latents.shape:
+            self.derivatives = torch.zeros(
+                (self.order, *latents.shape), dtype=latents.dtype, device=latents.device
+            )
+        # The ODE derivative (latents - pred_original_sample) / sigma reduces
+        # algebraically to the model output, so storing it is a single copy
+        self.derivatives[idx % self.order].copy_(output)
+        # Compute previous sample based on the derivatives path
+        return _lms_update(latents, self.derivatives, self.lms_coeff_slots[idx])
 
 class DPMScheduler():
     def __init__(